@@ -1,55 +1,209 @@
-import google.generativeai as genai
+import collections
+import functools
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decouple import config
 import json
+import logging
 
 # --- Configuration ---
 GEMINI_API_KEY = config('GEMINI_API_KEY', default=None)
+# Flash-Lite does not "think" by default; google-generativeai has no thinking config to cap it otherwise
+GEMINI_MODEL = config('GEMINI_MODEL', default='gemini-2.5-flash-lite')
+RESPONSE_CACHE_FILE = '_cache.sqlite'
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESPONSE_MEMORY_CACHE_SIZE = 256
+RESPONSE_CACHE_KEY_FIELDS = ('country', 'eventName', 'actual', 'forecast', 'prev')
+MAX_CONCURRENT_ANALYSES = 4 # Stay well within Gemini's rate limits
 
-# Configure the Gemini client
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# --- Static Prompt (identical for every event, sent as the system instruction) ---
+SYSTEM_INSTRUCTION = (
+    "You are an expert financial analyst specializing in the commodities market, "
+    "with a deep understanding of how economic indicators affect Gold (XAU/USD) and Silver (XAG/USD)."
+)
 
-def analyze_event(event_data):
-    """
-    Sends economic event data to Gemini for analysis and returns a structured response.
-    'event_data' should be a dictionary for a single event from Finnhub.
-    """
-    if not GEMINI_API_KEY:
-        return {"error": "Gemini API key not configured."}
-
-    model = genai.GenerativeModel('gemini-pro')
-
-    prompt = f"""
-    You are an expert financial analyst specializing in the commodities market, with a deep understanding of how economic indicators affect Gold (XAU/USD) and Silver (XAG/USD).
-
-    Analyze the following just-released economic data point and return your response ONLY in a JSON format. Do not add any other text, explanation, or markdown formatting outside of the JSON structure.
-
-    Input Data:
-    {{
-      "country": "{event_data.get('country')}",
-      "eventName": "{event_data.get('eventName')}",
-      "actual": {event_data.get('actual')},
-      "forecast": {event_data.get('forecast')},
-      "previous": {event_data.get('prev')}
-    }}
-
-    Required JSON Output Structure:
-    {{
-      "summary": "A brief, 1-2 sentence explanation of what this economic indicator is, in Hinglish.",
-      "analysis": "A short analysis comparing the 'actual' to the 'forecast' values and what this means, in Hinglish.",
-      "impact_on_commodities": "An explanation of the likely short-term impact on Gold and Silver, explaining the reasoning (effect on USD, Fed policy, etc.), in Hinglish.",
-      "gold_impact_score": <An integer from 1 to 10>,
-      "silver_impact_score": <An integer from 1 to 10>
-    }}
-    """
+ANALYSIS_INSTRUCTIONS = """
+Analyze the just-released economic data point given as Input Data and return your response ONLY in a JSON format. Do not add any other text, explanation, or markdown formatting outside of the JSON structure.
+
+Required JSON Output Structure:
+{
+  "summary": "A brief, 1-2 sentence explanation of what this economic indicator is, in Hinglish.",
+  "analysis": "A short analysis comparing the 'actual' to the 'forecast' values and what this means, in Hinglish.",
+  "impact_on_commodities": "An explanation of the likely short-term impact on Gold and Silver, explaining the reasoning (effect on USD, Fed policy, etc.), in Hinglish.",
+  "gold_impact_score": <An integer from 1 to 10>,
+  "silver_impact_score": <An integer from 1 to 10>
+}
+"""
+
+# Only this block varies per event; placeholders are filled with JSON-encoded values
+_PROMPT_TMPL = """Input Data:
+{{
+  "country": {country},
+  "eventName": {eventName},
+  "actual": {actual},
+  "forecast": {forecast},
+  "previous": {prev}
+}}"""
+
+# Gemini's JSON mode validates the output against this schema, so no markdown clean-up is needed
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "analysis": {"type": "string"},
+        "impact_on_commodities": {"type": "string"},
+        "gold_impact_score": {"type": "integer"},
+        "silver_impact_score": {"type": "integer"},
+    },
+    "required": ["summary", "analysis", "impact_on_commodities", "gold_impact_score", "silver_impact_score"],
+}
+
+GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': RESPONSE_SCHEMA,
+    'temperature': 0, # Deterministic output, so the response cache is always valid for identical inputs
+    'max_output_tokens': 1024, # Three short Hinglish paragraphs and two scores
+}
+
+log = logging.getLogger(__name__)
+
+# The Gemini SDK pulls in a large dependency tree (grpc, protobuf), so it is only
+# imported the first time an event actually needs to be sent to Gemini
+_genai = None
+_MODEL = None
+_genai_lock = threading.Lock()
+
+def _load_genai():
+    """Imports and configures the Gemini client on first use."""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _genai = genai
+    return _genai
+
+# --- Response Cache (identical inputs are never sent to Gemini twice) ---
+# Bounded LRU in front of sqlite: key -> (response, ts)
+_memory_cache = collections.OrderedDict()
+
+@functools.lru_cache(maxsize=1)
+def _get_cache_db():
+    db = sqlite3.connect(RESPONSE_CACHE_FILE)
+    db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response_json TEXT, ts INTEGER)")
+    db.execute("DELETE FROM responses WHERE ts < ?", (int(time.time()) - RESPONSE_CACHE_TTL_SECONDS,))
+    db.commit()
+    return db
+
+def _remember(key, cached):
+    _memory_cache[key] = cached
+    _memory_cache.move_to_end(key)
+    if len(_memory_cache) > RESPONSE_MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+def _cache_key(event_data):
+    normalized = {k: event_data.get(k) for k in RESPONSE_CACHE_KEY_FIELDS}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
 
+def _load_cached_response(key):
+    now = int(time.time())
+    cached = _memory_cache.get(key)
+    if cached is None:
+        row = _get_cache_db().execute("SELECT response_json, ts FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        cached = (json.loads(row[0]), row[1])
+
+    response, ts = cached
+    if now - ts > RESPONSE_CACHE_TTL_SECONDS:
+        _memory_cache.pop(key, None)
+        return None
+    _remember(key, cached)
+    return response
+
+def _store_cached_response(key, response):
+    ts = int(time.time())
+    _remember(key, (response, ts))
+    db = _get_cache_db()
+    db.execute("INSERT OR REPLACE INTO responses (key, response_json, ts) VALUES (?, ?, ?)",
+               (key, json.dumps(response), ts))
+    db.commit()
+
+def _build_prompt(event_data):
+    values = collections.defaultdict(lambda: 'null', {k: json.dumps(v) for k, v in event_data.items()})
+    return _PROMPT_TMPL.format_map(values)
+
+def _get_model():
+    """Returns the shared GenerativeModel, built once per process instead of once per call."""
+    global _MODEL
+    _load_genai()
+    with _genai_lock:
+        if _MODEL is None:
+            _MODEL = _genai.GenerativeModel(
+                GEMINI_MODEL,
+                system_instruction=f"{SYSTEM_INSTRUCTION}\n{ANALYSIS_INSTRUCTIONS}",
+                generation_config=GENERATION_CONFIG,
+            )
+        return _MODEL
+
+def _request_analysis(event_data):
+    """Asks Gemini to analyze a single event. Safe to call from worker threads."""
     try:
-        response = model.generate_content(prompt)
-        # Clean up the response to ensure it's valid JSON
-        cleaned_json = response.text.strip().replace('```json', '').replace('```', '')
-        return json.loads(cleaned_json)
+        response = _get_model().generate_content(_build_prompt(event_data))
+        if response.candidates and response.candidates[0].finish_reason.name == 'MAX_TOKENS':
+            # A truncated answer is not valid JSON; say why instead of surfacing a parse error
+            log.warning("Gemini stopped at max_output_tokens (%d) for %s.",
+                        GENERATION_CONFIG['max_output_tokens'], event_data.get('eventName'))
+            return {"error": "Gemini response truncated at max_output_tokens."}
+        return json.loads(response.text)
     except Exception as e:
-        print(f"ERROR: Failed to get analysis from Gemini. Error: {e}")
+        log.error("Failed to get analysis from Gemini. Error: %s", e)
         return {"error": str(e)}
 
-      
+def analyze_events(event_data_list):
+    """
+    Analyzes several events at once, returning one response per event in the same order.
+    Cache misses are sent to Gemini concurrently, at most MAX_CONCURRENT_ANALYSES at a time.
+    """
+    if not GEMINI_API_KEY:
+        return [{"error": "Gemini API key not configured."} for _ in event_data_list]
+
+    keys = [_cache_key(event_data) for event_data in event_data_list]
+    results = []
+    for key, event_data in zip(keys, event_data_list):
+        try:
+            cached = _load_cached_response(key)
+        except sqlite3.Error as e:
+            log.warning("Could not read Gemini response cache. Error: %s", e)
+            cached = None
+        if cached is not None:
+            log.info("Using cached Gemini analysis for %s", event_data.get('eventName'))
+        results.append(cached)
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+
+    _load_genai()
+
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_ANALYSES, len(misses))) as executor:
+        analyses = executor.map(_request_analysis, [event_data_list[i] for i in misses])
+        for i, analysis in zip(misses, analyses):
+            results[i] = analysis
+            if "error" in analysis:
+                continue
+            try:
+                _store_cached_response(keys[i], analysis)
+            except sqlite3.Error as e:
+                log.warning("Could not write Gemini response cache. Error: %s", e)
+    return results
+
+def analyze_event(event_data):
+    """
+    Sends economic event data to Gemini for analysis and returns a structured response.
+    'event_data' should be a dictionary for a single event from Finnhub.
+    """
+    return analyze_events([event_data])[0]
@@ -1,8 +1,14 @@
 import os
-import json
+import logging
+import orjson
+import hashlib
+import re
 import time
 from datetime import datetime, timedelta, timezone
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from decouple import config
 
 # Import our custom modules
@@ -10,60 +16,205 @@ import telegram_bot
 import gemini_analyzer
 
 # --- Configuration ---
-IMPACT_FILTER = ['low', 'medium', 'high']
-COUNTRY_FILTER = ['US', 'EZ', 'CN', 'GB', 'JP', 'DE', 'FR', 'AU', 'CH', 'IN']
+IMPACT_FILTER = frozenset({'low', 'medium', 'high'})
+COUNTRY_FILTER = frozenset({'US', 'EZ', 'CN', 'GB', 'JP', 'DE', 'FR', 'AU', 'CH', 'IN'})
 PRE_ALERT_MINUTES = 5
-STATE_FILE = 'processed_events.json'
-SCHEDULE_FILE = 'todays_schedule.json'
+POST_ANALYSIS_MINUTES = 3
+STATE_FILE = 'processed_events.log'
+MAX_PROCESSED_EVENTS = 10000
+PROCESSED_EVENTS_RETENTION_DAYS = 7
+SCHEDULE_FILE = 'todays_schedule.json' # Snapshot for inspection; the bot works from memory
+REQUEST_TIMEOUT = 10
+
+logging.basicConfig(level=config('LOG_LEVEL', default='INFO').upper(), format='%(asctime)s %(levelname)s %(message)s')
+log = logging.getLogger('bot')
 
 # --- Securely load API keys from environment variables ---
 # *** IMPORTANT: Use your FMP API Key for this variable ***
 FMP_API_KEY = config('FMP_API_KEY', default=None)
+# FMP's endpoint requires no date for the current day's calendar
+FMP_CALENDAR_URL = f"https://financialmodelingprep.com/api/v3/economic_calendar?apikey={FMP_API_KEY}"
 
+# Shared keep-alive session for all FMP calls
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+))
 
-# --- State and Schedule Management ---
-def load_json_file(filename, default_value):
-    if not os.path.exists(filename):
-        return default_value
-    with open(filename, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return default_value
 
+def passes_filters(event, _impact_ok=IMPACT_FILTER.__contains__, _country_ok=COUNTRY_FILTER.__contains__):
+    """True if the event matches both IMPACT_FILTER and COUNTRY_FILTER."""
+    return _impact_ok(event.get('impact')) and _country_ok(event.get('country'))
+
+# --- State and Schedule Management ---
 def save_json_file(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(filename, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
-def save_processed_event(event_id):
-    processed_events = set(load_json_file(STATE_FILE, []))
-    processed_events.add(event_id)
-    save_json_file(STATE_FILE, list(processed_events))
+# Processed event ids are kept in memory and persisted as an append-only log (one id per line)
+_state_fp = None
+
+def load_processed_events():
+    if not os.path.exists(STATE_FILE):
+        return set()
+    with open(STATE_FILE, 'r') as f:
+        return set(f.read().splitlines())
+
+def save_processed_event(processed_ids, event_id):
+    global _state_fp
+    if _state_fp is None:
+        _state_fp = open(STATE_FILE, 'a', buffering=1)
+    processed_ids.add(event_id)
+    _state_fp.write(event_id + '\n')
+    _state_fp.flush()
+
+# Event ids end with the FMP event date, e.g. "post-CPI-US-2024-03-12 12:30:00"
+_EVENT_ID_DATE = re.compile(r'\d{4}-\d{2}-\d{2}[T ][\d:.]+(?:Z|[+-]\d{2}:\d{2})?$')
+
+def _event_id_time(event_id):
+    """The event date embedded in an id, or None if it has none."""
+    match = _EVENT_ID_DATE.search(event_id)
+    try:
+        return parse_event_time(match.group()) if match else None
+    except ValueError:
+        return None
+
+def _trim_old(processed_ids, now_utc):
+    """
+    Drops ids whose event date is older than the retention period, then keeps at most the
+    newest MAX_PROCESSED_EVENTS // 2 so the next compaction is always far away.
+    """
+    cutoff = now_utc - timedelta(days=PROCESSED_EVENTS_RETENTION_DAYS)
+    dated = [(_event_id_time(event_id), event_id) for event_id in processed_ids]
+    kept = [(event_time, event_id) for event_time, event_id in dated if event_time is None or event_time >= cutoff]
+    low_water_mark = MAX_PROCESSED_EVENTS // 2
+    if len(kept) <= low_water_mark:
+        return {event_id for _, event_id in kept}
+
+    # Ids without a parseable date sort as the oldest
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    kept.sort(key=lambda item: item[0] or oldest, reverse=True)
+    return {event_id for _, event_id in kept[:low_water_mark]}
+
+def compact_processed_events(processed_ids, now_utc):
+    """Keeps the processed-event log bounded by rewriting it without old ids once it grows too large."""
+    global _state_fp
+    if len(processed_ids) <= MAX_PROCESSED_EVENTS:
+        return processed_ids
+
+    processed_ids = _trim_old(processed_ids, now_utc)
+    if _state_fp is not None:
+        _state_fp.close()
+        _state_fp = None
+    tmp_file = STATE_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.writelines(event_id + '\n' for event_id in processed_ids)
+    os.replace(tmp_file, STATE_FILE)
+    log.info("Compacted processed events log to %d ids.", len(processed_ids))
+    return processed_ids
 
 # --- Core Functions ---
-def fetch_daily_schedule():
-    """Makes one API call to get the schedule for the next 24 hours."""
+# The last schedule payload, so an unchanged response is neither re-parsed nor re-written
+_last_schedule_bytes_len = None
+_last_schedule_hash = None
+_last_schedule_parsed = None
+# Validators from the last response, sent back so FMP can answer 304 Not Modified
+_last_etag = None
+_last_modified = None
+# Unix timestamps of every scheduled event, rebuilt whenever a new schedule is parsed
+_schedule_ts = np.empty(0, dtype=np.int64)
+
+def parse_event_time(date_str):
+    """Parses an FMP event date into an aware UTC datetime. Dates without an offset are UTC."""
+    # FMP uses ISO format, sometimes with 'Z' for UTC
+    event_time = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+    if event_time.tzinfo is None:
+        event_time = event_time.replace(tzinfo=timezone.utc)
+    return event_time
+
+def seconds_until_next_boundary(diffs):
+    """Seconds until the next pre-alert, release or end-of-window edge, or None if there is none."""
+    edges = np.concatenate((diffs - PRE_ALERT_MINUTES * 60, diffs, diffs + POST_ANALYSIS_MINUTES * 60))
+    upcoming = edges[edges > 0]
+    return int(upcoming.min()) if upcoming.size else None
+
+def fetch_schedule_raw():
+    """Fetches and parses the current calendar from FMP without touching SCHEDULE_FILE."""
+    global _last_schedule_bytes_len, _last_schedule_hash, _last_schedule_parsed, _schedule_ts
+    global _last_etag, _last_modified
+
     if not FMP_API_KEY:
-        print("FATAL ERROR: FMP_API_KEY not set.")
+        log.critical("FMP_API_KEY not set.")
         return None
     
-    print("INFO: Fetching new daily schedule from FMP...")
     try:
-        # FMP's endpoint requires no date for the current day's calendar
-        url = f"https://financialmodelingprep.com/api/v3/economic_calendar?apikey={FMP_API_KEY}"
-        response = requests.get(url)
+        headers = {}
+        if _last_schedule_parsed is not None:
+            if _last_etag:
+                headers['If-None-Match'] = _last_etag
+            if _last_modified:
+                headers['If-Modified-Since'] = _last_modified
+
+        response = _SESSION.get(FMP_CALENDAR_URL, headers=headers, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        schedule = response.json()
-        save_json_file(SCHEDULE_FILE, schedule)
-        print(f"SUCCESS: Saved schedule with {len(schedule)} events.")
+        if response.status_code == 304:
+            log.info("Schedule not modified since last fetch.")
+            return _last_schedule_parsed
+
+        # Not every response carries validators, so also compare the payload itself
+        # Cheap length check first, then the hash
+        content = response.content
+        if len(content) == _last_schedule_bytes_len:
+            content_hash = hashlib.sha256(content).hexdigest()
+            if content_hash == _last_schedule_hash:
+                log.info("Schedule unchanged since last fetch.")
+                return _last_schedule_parsed
+        else:
+            content_hash = hashlib.sha256(content).hexdigest()
+
+        # The filters are static, so keep only the relevant slice of the global calendar
+        events = orjson.loads(content)
+        if not isinstance(events, list):
+            # FMP reports some errors (e.g. an invalid key) as a 200 with an {"Error Message": ...} body
+            raise ValueError(f"Unexpected schedule payload: {events}")
+        schedule = [e for e in events if passes_filters(e)]
+        # Parse each event time once here instead of on every tick
+        for e in schedule:
+            e['_ts'] = parse_event_time(e['date']).timestamp()
+        _last_schedule_bytes_len = len(content)
+        _last_schedule_hash = content_hash
+        _last_schedule_parsed = schedule
+        # Only remember validators for a payload that parsed, or a 304 could pin a bad response
+        _last_etag = response.headers.get('ETag')
+        _last_modified = response.headers.get('Last-Modified')
+        _schedule_ts = np.array([e['_ts'] for e in schedule], dtype=np.int64)
         return schedule
     except Exception as e:
-        print(f"ERROR: Could not fetch daily schedule. Error: {e}")
+        log.error("Could not fetch schedule. Error: %s", e)
         return None
 
+def persist_schedule(schedule):
+    save_json_file(SCHEDULE_FILE, schedule)
+    log.info("Saved schedule with %d events.", len(schedule))
+
+def fetch_daily_schedule():
+    """Makes one API call to get the schedule for the next 24 hours."""
+    log.info("Fetching new daily schedule from FMP...")
+    schedule = fetch_schedule_raw()
+    if schedule is not None:
+        persist_schedule(schedule)
+    return schedule
+
+def _actuals(schedule):
+    return {(e.get('eventName'), e.get('country'), e.get('date')): e.get('actual') for e in schedule}
+
 def run_bot():
     """The main long-running service loop for the bot."""
     last_schedule_fetch_date = None
+    schedule = []
+    processed_ids = load_processed_events()
     
     while True:
         try:
@@ -71,68 +222,63 @@ def run_bot():
             
             # --- 1. Daily Schedule Fetch Logic ---
             if last_schedule_fetch_date != now_utc.date():
-                schedule = fetch_daily_schedule()
-                if schedule is not None:
+                daily_schedule = fetch_daily_schedule()
+                if daily_schedule is not None:
+                    schedule = daily_schedule
                     last_schedule_fetch_date = now_utc.date()
                 else:
                     time.sleep(60) # Wait a minute before retrying if fetch fails
                     continue
             
             # --- 2. Check if we are near any event ---
-            schedule = load_json_file(SCHEDULE_FILE, [])
-            is_active_window = False
-            for event in schedule:
-                # FMP uses ISO format with 'Z' for UTC
-                event_time_utc = datetime.fromisoformat(event['date'].replace('Z', '+00:00'))
-                time_to_event = event_time_utc - now_utc
-                time_since_event = now_utc - event_time_utc
-                
-                # Active window is from 5 mins before to 3 mins after event
-                if timedelta(minutes=-PRE_ALERT_MINUTES) <= time_to_event <= timedelta(minutes=3):
-                    is_active_window = True
-                    break # Found an event in the window, no need to check others
+            # Active window is from 5 mins before to 3 mins after any event
+            now_ts = int(now_utc.timestamp())
+            diffs = _schedule_ts - now_ts
+            is_active_window = bool(np.any((diffs >= -POST_ANALYSIS_MINUTES * 60) & (diffs <= PRE_ALERT_MINUTES * 60)))
             
             # --- 3. The "Burst Mode" API Call ---
-            live_data = []
+            events_to_process = []
             if is_active_window:
-                print("INFO: Active window detected. Fetching live data...")
+                log.info("Active window detected. Fetching live data...")
                 # We re-fetch the calendar to get the 'actual' values
-                live_data = fetch_daily_schedule() # This will be our "live" data check
+                live_data = fetch_schedule_raw()
+                if live_data is not None:
+                    # Only rewrite the schedule file when a release actually came in
+                    if _actuals(live_data) != _actuals(schedule):
+                        persist_schedule(live_data)
+                    schedule = live_data
+                # If the live fetch failed, the cached schedule still drives pre-alerts
+                events_to_process = schedule
             else:
-                print(f"INFO: Dormant state. No events nearby. Sleeping... ({now_utc.strftime('%H:%M:%S')})")
+                log.debug("Dormant state. No events nearby. (%s)", now_utc)
 
             # --- 4. Process Events ---
-            processed_ids = set(load_json_file(STATE_FILE, []))
-            # Use live_data if available, otherwise the saved schedule for pre-alerts
-            events_to_process = live_data if live_data is not None else schedule
+            pending_analyses = []
+            pending_messages = []
 
             for event in events_to_process:
-                if event.get('impact') not in IMPACT_FILTER or event.get('country') not in COUNTRY_FILTER:
-                    continue
-
-                event_time_utc = datetime.fromisoformat(event['date'].replace('Z', '+00:00'))
                 event_id = f"{event['eventName']}-{event['country']}-{event['date']}"
                 pre_alert_id = f"pre-{event_id}"
                 post_analysis_id = f"post-{event_id}"
 
                 # Pre-Alert Logic
-                time_to_event = event_time_utc - now_utc
-                if timedelta(minutes=0) < time_to_event <= timedelta(minutes=PRE_ALERT_MINUTES):
+                time_to_event = event['_ts'] - now_ts
+                if 0 < time_to_event <= PRE_ALERT_MINUTES * 60:
                     if pre_alert_id not in processed_ids:
-                        print(f"ACTION: Sending pre-event alert for {event['eventName']}")
-                        minutes_left = int(time_to_event.total_seconds() / 60)
+                        log.info("Sending pre-event alert for %s", event['eventName'])
+                        minutes_left = int(time_to_event / 60)
                         message = (f"⚠️ *Heads-Up Alert!* ⚠️\n\n"
                                    f"**Event:** {event['eventName']} ({event['country']})\n"
                                    f"**Releasing in:** Approximately {minutes_left} minutes")
-                        telegram_bot.send_message(message)
-                        save_processed_event(pre_alert_id)
+                        pending_messages.append(message)
+                        save_processed_event(processed_ids, pre_alert_id)
                 
                 # Post-Analysis Logic
                 if event.get('actual') is not None:
-                    time_since_release = now_utc - event_time_utc
-                    if timedelta(minutes=0) <= time_since_release < timedelta(minutes=3):
+                    time_since_release = now_ts - event['_ts']
+                    if 0 <= time_since_release < POST_ANALYSIS_MINUTES * 60:
                         if post_analysis_id not in processed_ids:
-                            print(f"ACTION: Performing post-event analysis for {event['eventName']}")
+                            log.info("Performing post-event analysis for %s", event['eventName'])
                             # We need to adapt the keys for Gemini to match FMP's output
                             fmp_event_data = {
                                 'country': event.get('country'),
@@ -141,22 +287,37 @@ def run_bot():
                                 'forecast': event.get('estimate'), # FMP uses 'estimate'
                                 'prev': event.get('previous') # FMP uses 'previous'
                             }
-                            analysis = gemini_analyzer.analyze_event(fmp_event_data)
-                            
-                            if analysis and "error" not in analysis:
-                                message = (f"📈 *New Economic Data: {event['eventName']} ({event['country']})*\n\n"
-                                           f"*Summary:* {analysis.get('summary')}\n\n"
-                                           f"*Analysis:* {analysis.get('analysis')}\n\n"
-                                           f"*Impact on Commodities:* {analysis.get('impact_on_commodities')}\n\n"
-                                           f"*Gold Impact Score:* {analysis.get('gold_impact_score')}/10\n"
-                                           f"*Silver Impact Score:* {analysis.get('silver_impact_score')}/10")
-                                telegram_bot.send_message(message)
-                                save_processed_event(post_analysis_id)
+                            pending_analyses.append((event, fmp_event_data, post_analysis_id))
+
+            # Releases often cluster (e.g. NFP day), so analyze them concurrently
+            if pending_analyses:
+                analyses = gemini_analyzer.analyze_events([data for _, data, _ in pending_analyses])
+                for (event, _, post_analysis_id), analysis in zip(pending_analyses, analyses):
+                    if analysis and "error" not in analysis:
+                        message = (f"📈 *New Economic Data: {event['eventName']} ({event['country']})*\n\n"
+                                   f"*Summary:* {analysis.get('summary')}\n\n"
+                                   f"*Analysis:* {analysis.get('analysis')}\n\n"
+                                   f"*Impact on Commodities:* {analysis.get('impact_on_commodities')}\n\n"
+                                   f"*Gold Impact Score:* {analysis.get('gold_impact_score')}/10\n"
+                                   f"*Silver Impact Score:* {analysis.get('silver_impact_score')}/10")
+                        pending_messages.append(message)
+                        save_processed_event(processed_ids, post_analysis_id)
+
+            # Everything from this tick goes out together, in as few Telegram messages as possible
+            telegram_bot.send_batch(pending_messages)
+            processed_ids = compact_processed_events(processed_ids, now_utc)
             
-            time.sleep(60) # Wait for 60 seconds before the next check
+            # Wake up at the next window edge, but check at least once a minute
+            next_boundary = seconds_until_next_boundary(diffs)
+            if next_boundary is not None:
+                # diffs are from the start of the tick; don't oversleep by the time spent fetching and analyzing
+                next_boundary -= int(time.time()) - now_ts
+            sleep_seconds = 60 if next_boundary is None else min(60, max(1, next_boundary))
+            log.debug("Sleeping for %ds.", sleep_seconds)
+            time.sleep(sleep_seconds)
 
         except Exception as e:
-            print(f"FATAL ERROR in main loop: {e}")
+            log.exception("Fatal error in main loop: %s", e)
             telegram_bot.send_message(f"🚨 **Bot Error!** 🚨\n\nA fatal error occurred: {e}")
             time.sleep(300) # Wait 5 minutes before restarting after a major crash
 
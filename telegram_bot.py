@@ -1,21 +1,38 @@
 import os
+import logging
+import queue
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from decouple import config
 
 # --- Configuration ---
 # These will be read from your environment variables in Dokploy
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN', default=None)
 TELEGRAM_CHAT_ID = config('TELEGRAM_CHAT_ID', default=None)
+REQUEST_TIMEOUT = 5
+MAX_BATCH_LENGTH = 4000 # Telegram allows 4096 characters per message; keep some headroom
+BATCH_WINDOW_SECONDS = 0.1
+MESSAGE_SEPARATOR = "\n\n━━━━━━\n\n"
 
-def send_message(message_text):
-    """Sends a message to the configured Telegram chat."""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("ERROR: Telegram environment variables (TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID) not set.")
-        return
+log = logging.getLogger(__name__)
+
+# Using the Telegram Bot API endpoint
+SEND_MESSAGE_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+# A single pooled session keeps the connection to api.telegram.org alive between messages
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=4,
+    # POSTs are only retried on 429 (rate limited, never delivered); a 5xx may already have sent the message
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429], allowed_methods=frozenset({'POST'})),
+))
 
-    # Using the Telegram Bot API endpoint
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    
+def _post_message(message_text):
+    """Posts a single message to the configured Telegram chat. Returns the HTTP status, or None if there was no response."""
     payload = {
         'chat_id': TELEGRAM_CHAT_ID,
         'text': message_text,
@@ -23,15 +40,98 @@ def send_message(message_text):
     }
 
     try:
-        response = requests.post(url, json=payload)
+        response = _SESSION.post(SEND_MESSAGE_URL, json=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        print("SUCCESS: Message sent to Telegram.")
+        log.info("Message sent to Telegram.")
+        return response.status_code
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: Failed to send message to Telegram. Error: {e}")
+        log.error("Failed to send message to Telegram. Error: %s", e)
+        return e.response.status_code if e.response is not None else None
+
+def _split_message(message):
+    """Splits a message longer than MAX_BATCH_LENGTH into chunks, preferring line breaks."""
+    chunks = []
+    while len(message) > MAX_BATCH_LENGTH:
+        cut = message.rfind('\n', 0, MAX_BATCH_LENGTH)
+        if cut <= 0:
+            cut = MAX_BATCH_LENGTH
+        chunks.append(message[:cut])
+        message = message[cut:].lstrip('\n')
+    chunks.append(message)
+    return chunks
+
+def _pack_messages(messages):
+    """Groups messages into as few payloads of at most MAX_BATCH_LENGTH characters as possible."""
+    groups = []
+    length = 0
+    for message in messages:
+        for part in _split_message(message):
+            if groups and length + len(MESSAGE_SEPARATOR) + len(part) <= MAX_BATCH_LENGTH:
+                groups[-1].append(part)
+                length += len(MESSAGE_SEPARATOR) + len(part)
+            else:
+                groups.append([part])
+                length = len(part)
+    return groups
+
+def _post_group(parts):
+    status = _post_message(MESSAGE_SEPARATOR.join(parts))
+    if status == 400 and len(parts) > 1:
+        # Most likely unbalanced Markdown in one part; send them separately so only that one is lost
+        log.warning("Telegram rejected a batch of %d messages. Sending them one by one.", len(parts))
+        for part in parts:
+            _post_message(part)
+
+# --- Background Sender ---
+# Lists of messages are queued and posted by a daemon thread so callers never wait on the Telegram API
+_Q = queue.Queue()
+
+def _worker():
+    while True:
+        items = [_Q.get()]
+        # Collect anything else queued shortly after, so a burst goes out as one message
+        deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                items.append(_Q.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            for parts in _pack_messages([message for item in items for message in item]):
+                _post_group(parts)
+        except Exception as e:
+            # Never let one bad batch kill the sender thread
+            log.exception("Telegram sender failed. Error: %s", e)
+        finally:
+            for _ in items:
+                _Q.task_done()
+
+threading.Thread(target=_worker, name='telegram-sender', daemon=True).start()
+
+def send_message(message_text):
+    """Queues a message for the configured Telegram chat and returns immediately."""
+    send_batch([message_text])
+
+def send_batch(messages):
+    """Queues several messages, joined into as few Telegram messages as the length limit allows."""
+    if not messages:
+        return
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+        log.error("Telegram environment variables (TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID) not set.")
+        return
+
+    _Q.put(list(messages))
+
+def flush():
+    """Blocks until every queued message has been sent."""
+    _Q.join()
 
 if __name__ == '__main__':
     # This is for testing the Telegram bot directly
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
     print("Testing Telegram bot...")
     send_message("Hello from the Market Intel Bot! The connection is working.")
+    flush()
     print("Test complete.")
   